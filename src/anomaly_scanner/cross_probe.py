@@ -1,15 +1,20 @@
 from __future__ import annotations
 import argparse
-import difflib
-import subprocess
+import hashlib
+import json
+import math
+import runpy
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Callable, Dict, List, Optional, Tuple
 
 import numpy as np
 from dotenv import load_dotenv  # auto-load .env
+from rapidfuzz.distance import Indel
+from rapidfuzz.process import cdist
 
 # Load environment variables from .env at repo root
 load_dotenv()
@@ -19,83 +24,214 @@ from providers.openai_provider import OpenAIProvider
 from providers.anthropic_provider import AnthropicProvider
 
 
+# Recorded in card meta so consumers know what the similarity scores compare
+CANONICALIZATION = "whitespace runs collapsed to one space, casefolded"
+# Not comparable with cards scored by difflib's Ratcliff-Obershelp ratio (see README)
+SCORER = "rapidfuzz-indel"
+
+
+def canonicalize(text: str) -> str:
+    """Form a response is scored in; raw responses are kept for reporting."""
+    return " ".join(text.split()).casefold()
+
+
+def _unique(values: List[str]) -> Tuple[List[str], np.ndarray]:
+    """Distinct values (first-seen order) plus the inverse index that maps them back onto the input."""
+    # Group by hash in one pass; str hashes are cached and dict lookup confirms equality
+    index: Dict[str, int] = {}
+    inverse = np.fromiter(
+        (index.setdefault(v, len(index)) for v in values), dtype=np.intp, count=len(values)
+    )
+    return list(index), inverse
+
+
+def _score_unique(
+    kernel: Callable[[List[str], List[str]], np.ndarray],
+    queries: List[str],
+    choices: Optional[List[str]] = None,
+) -> np.ndarray:
+    """
+    Run kernel on the distinct canonical strings only, then gather back to the
+    full shape. Canonicalizing first also folds responses that differ only in
+    whitespace or case into one kernel row.
+    """
+    uq, qi = _unique([canonicalize(r) for r in queries])
+    if choices is None:
+        # Pass the same list twice so symmetric kernels can skip the lower triangle
+        uc, ci = uq, qi
+    else:
+        uc, ci = _unique([canonicalize(r) for r in choices])
+    return kernel(uq, uc)[np.ix_(qi, ci)]
+
+
+def similarity_matrix(queries: List[str], choices: Optional[List[str]] = None) -> np.ndarray:
+    """Pairwise similarity of every query against every choice (defaults to the queries)."""
+    return _score_unique(_cdist_matrix, queries, choices)
+
+
+def _cdist_matrix(queries: List[str], choices: List[str]) -> np.ndarray:
+    return cdist(queries, choices, scorer=Indel.normalized_similarity, dtype=np.float64, workers=-1)
+
+
+# How many raw responses a run keeps for the card's samples
+SAMPLE_SIZE = 3
+
+
 @dataclass
 class ProviderRun:
+    """
+    Scoring view of one provider's responses. Only the first SAMPLE_SIZE raw
+    responses are retained for reporting; the full list can be dropped once
+    the run is built.
+    """
     name: str
-    responses: List[str]
-    pairwise: List[Tuple[int, int, float]]
+    sample_responses: List[str]
+    # Upper-triangle pair scores in row-major order: (0, 1), (0, 2), ..., (1, 2), ...
+    scores: np.ndarray
     mean_similarity: float
     min_similarity: float
 
     @staticmethod
     def seq_sim(a: str, b: str) -> float:
-        return difflib.SequenceMatcher(a=a, b=b).ratio()
+        return Indel.normalized_similarity(canonicalize(a), canonicalize(b))
 
     @classmethod
     def from_responses(cls, name: str, responses: List[str]) -> "ProviderRun":
-        sims: List[Tuple[int, int, float]] = []
+        return cls.from_matrix(name, responses, similarity_matrix(responses))
+
+    @classmethod
+    def from_matrix(cls, name: str, responses: List[str], matrix: np.ndarray) -> "ProviderRun":
+        """Build a run from a precomputed N x N self-similarity matrix."""
         n = len(responses)
-        for i in range(n):
-            for j in range(i + 1, n):
-                sims.append((i, j, cls.seq_sim(responses[i], responses[j])))
-        scores = [s for (_, _, s) in sims] or [1.0]
+        # Keep the upper triangle (i < j); the default --runs 3 and runs=2 are unrolled
+        if n == 3:
+            pairs = [matrix[0, 1], matrix[0, 2], matrix[1, 2]]
+        elif n == 2:
+            pairs = [matrix[0, 1]]
+        else:
+            pairs = matrix[np.triu_indices(n, 1)].tolist()
+        # Only the stored scores are quantized; published stats use full precision
+        stats = [float(s) for s in pairs] or [1.0]
         return cls(
             name=name,
-            responses=responses,
-            pairwise=sims,
-            mean_similarity=float(np.mean(scores)),
-            min_similarity=float(np.min(scores)),
+            sample_responses=responses[:SAMPLE_SIZE],
+            scores=np.array(pairs, dtype=np.float32),
+            mean_similarity=math.fsum(stats) / len(stats),
+            min_similarity=min(stats),
         )
 
 
+def best_match_similarity(matrix: np.ndarray) -> float:
+    """Average best-match similarity from a precomputed |a| x |b| cross matrix."""
+    if matrix.size == 0:
+        return 1.0
+    # Row maxima are the best match for each a, column maxima the best match for each b.
+    totals = matrix.max(axis=1).tolist() + matrix.max(axis=0).tolist()
+    return math.fsum(totals) / len(totals)
+
+
 def cross_similarity(a: List[str], b: List[str]) -> float:
     """Average best-match similarity across two response sets."""
     if not a or not b:
         return 1.0
-    totals = []
-    for ai in a:
-        best = max(difflib.SequenceMatcher(a=ai, b=bj).ratio() for bj in b)
-        totals.append(best)
-    for bj in b:
-        best = max(difflib.SequenceMatcher(a=bj, b=ai).ratio() for ai in a)
-        totals.append(best)
-    return float(np.mean(totals)) if totals else 1.0
+    return best_match_similarity(similarity_matrix(a, b))
+
+
+def min_within_similarity(within: Dict[str, ProviderRun]) -> float:
+    """Lowest within-provider mean similarity (1.0 when there are no runs)."""
+    return min((p.mean_similarity for p in within.values()), default=1.0)
 
 
-def classify(sep_cross: float, within: Dict[str, ProviderRun], threshold: float) -> str:
+def classify(
+    sep_cross: float,
+    within: Dict[str, ProviderRun],
+    threshold: float,
+    min_within: Optional[float] = None,
+) -> str:
     """
     Severity rules focused on *provider divergence*:
     - If cross-sim < 0.60 -> high
     - elif cross-sim < threshold (default 0.85) -> medium
     - elif any provider within-mean < threshold -> low
     - else none
+    Pass min_within when the caller already has it to avoid walking within again.
     """
+    if min_within is None:
+        min_within = min_within_similarity(within)
     if sep_cross < 0.60:
         return "high"
     if sep_cross < threshold:
         return "medium"
-    if any(p.mean_similarity < threshold for p in within.values()):
-        return "low"
-    return "none"
+    return "low" if min_within < threshold else "none"
+
+
+def _run_index_script(script: Path) -> int:
+    """
+    Run the script in this interpreter, exactly as `python script` would,
+    to skip the cold start of a second Python process. Returns its exit code.
+    """
+    saved_argv, saved_path = sys.argv, sys.path[:]
+    sys.argv = [str(script)]
+    sys.path.insert(0, str(script.parent))
+    try:
+        runpy.run_path(str(script), run_name="__main__")
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            return e.code or 0
+        # sys.exit("message"): print it to stderr like the interpreter would
+        print(f"[pages] update_index.py: {e.code}", file=sys.stderr)
+        return 1
+    finally:
+        sys.argv, sys.path[:] = saved_argv, saved_path
+    return 0
 
 
-def _update_index_page() -> None:
+def _update_index_page() -> bool:
     """
     Keep GitHub Pages homepage in sync:
     Runs scripts/update_index.py if it exists; logs but never fails the probe.
+    Returns True when the index was updated.
     """
     script = Path("scripts") / "update_index.py"
     if not script.exists():
         print("[pages] scripts/update_index.py not found; skipping index update.")
-        return
+        return False
     try:
-        rc = subprocess.call([sys.executable, str(script)])
+        rc = _run_index_script(script)
         if rc == 0:
             print("[pages] index.md updated from LATEST_ANOMALY.md.")
-        else:
-            print(f"[pages] update_index.py exited with code {rc} (continuing).")
+            return True
+        print(f"[pages] update_index.py exited with code {rc} (continuing).")
     except Exception as e:
         print(f"[pages] failed to update index.md: {e!r} (continuing).")
+    return False
+
+
+def _card_key(card: AnomalyCard) -> str:
+    """Content hash of a card, ignoring its timestamp."""
+    content = {k: v for k, v in vars(card).items() if k != "timestamp"}
+    payload = json.dumps(content, sort_keys=True, default=str).encode()
+    return hashlib.blake2b(payload).hexdigest()
+
+
+def _publish(card: AnomalyCard, latest: Path) -> None:
+    """
+    Update the Pages index unless the card matches the one last published.
+    The key of the last published card is kept next to LATEST_ANOMALY.md.
+    """
+    key_file = latest.parent / ".last_card_key"
+    key = _card_key(card)
+    try:
+        if key_file.read_text().strip() == key:
+            print("[pages] card unchanged since last publish; skipping index update.")
+            return
+    except OSError:
+        pass
+    if _update_index_page():
+        try:
+            key_file.write_text(key)
+        except OSError as e:
+            print(f"[pages] could not record card key: {e!r} (continuing).")
 
 
 def main():
@@ -105,6 +241,7 @@ def main():
     ap.add_argument("--temperature", type=float, default=0.9)
     ap.add_argument("--threshold", type=float, default=0.85)
     ap.add_argument("--providers", default="openai,anthropic", help="comma list (supported: openai,anthropic)")
+    ap.add_argument("--no-publish", action="store_true", help="skip the GitHub Pages index update")
     args = ap.parse_args()
 
     # Instantiate providers
@@ -118,21 +255,42 @@ def main():
         else:
             raise ValueError(f"Unsupported provider: {p}")
 
-    # Collect runs
-    runs: Dict[str, ProviderRun] = {}
-    for prov in prov_objs:
-        responses = prov.generate(args.prompt, args.temperature, args.runs)
-        runs[prov.name] = ProviderRun.from_responses(prov.name, responses)
+    # Collect responses; provider round-trips overlap, results keep selection order
+    collected: Dict[str, List[str]] = {}
+    with ThreadPoolExecutor(max_workers=max(len(prov_objs), 1)) as ex:
+        futures = [
+            (prov.name, ex.submit(prov.generate, args.prompt, args.temperature, args.runs))
+            for prov in prov_objs
+        ]
+        for name, fut in futures:
+            collected[name] = fut.result()
 
-    # Cross-provider similarity (pairwise on first two selected)
-    names = list(runs.keys())
+    names = list(collected.keys())
     if len(names) < 2:
         raise RuntimeError("Need at least two providers for cross-provider drift.")
+
+    # Score every response against every other once; each provider's within-run
+    # matrix is a diagonal block and cross-provider similarity an off-diagonal one.
+    all_resp = [r for n in names for r in collected[n]]
+    matrix = similarity_matrix(all_resp)
+    spans: Dict[str, slice] = {}
+    runs: Dict[str, ProviderRun] = {}
+    start = 0
+    for n in names:
+        span = spans[n] = slice(start, start + len(collected[n]))
+        runs[n] = ProviderRun.from_matrix(n, collected[n], matrix[span, span])
+        start = span.stop
+
+    # Cross-provider similarity (pairwise on first two selected)
     a, b = names[0], names[1]
-    cross_sim = cross_similarity(runs[a].responses, runs[b].responses)
+    cross_sim = best_match_similarity(matrix[spans[a], spans[b]])
+
+    # Scoring is done; runs keep only their samples, so drop the full response sets
+    del collected, all_resp, matrix
 
     # Severity classification prioritizes cross divergence
-    severity = classify(cross_sim, runs, args.threshold)
+    min_within = min_within_similarity(runs)
+    severity = classify(cross_sim, runs, args.threshold, min_within=min_within)
 
     # Prepare card
     now = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
@@ -153,21 +311,27 @@ def main():
             "runs": args.runs,
             "temperature": args.temperature,
             "samples": {
-                a: runs[a].responses[:3],
-                b: runs[b].responses[:3],
+                a: runs[a].sample_responses,
+                b: runs[b].sample_responses,
             },
             "cross_similarity": cross_sim,
+            "canonicalization": CANONICALIZATION,
+            "scorer": SCORER,
             "within": {
                 a: {"mean": runs[a].mean_similarity, "min": runs[a].min_similarity},
                 b: {"mean": runs[b].mean_similarity, "min": runs[b].min_similarity},
             },
+            "min_within": min_within,
         },
     )
 
     paths = write_anomaly_outputs(card)
 
     # Keep GitHub Pages homepage synced with the latest anomaly
-    _update_index_page()
+    if args.no_publish:
+        print("[pages] --no-publish set; skipping index update.")
+    else:
+        _publish(card, Path(paths["latest"]))
 
     # Console
     print(f"[🔫] Cross-provider shot: {a} vs {b}")
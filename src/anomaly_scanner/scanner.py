@@ -1,7 +1,9 @@
+from dataclasses import dataclass
+
 import requests
-from pydantic import BaseModel
 
-class Anomaly(BaseModel):
+@dataclass(slots=True, frozen=True)
+class Anomaly:
     id: str
     description: str
     severity: str
@@ -0,0 +1,180 @@
+import difflib
+import importlib
+import sys
+import types
+from dataclasses import dataclass, field
+from unittest import mock
+
+import numpy as np
+import pytest
+from rapidfuzz.distance import Indel
+
+
+@dataclass
+class StubCard:
+    id: str
+    description: str
+    severity: str
+    timestamp: str
+    meta: dict = field(default_factory=dict)
+
+
+def _load_cross_probe():
+    """Import cross_probe with the provider and card modules (not in this tree) stubbed out."""
+    generator = types.ModuleType("reporting.generator")
+    generator.AnomalyCard = StubCard
+    generator.write_anomaly_outputs = lambda card: {}
+    openai_provider = types.ModuleType("providers.openai_provider")
+    openai_provider.OpenAIProvider = object
+    anthropic_provider = types.ModuleType("providers.anthropic_provider")
+    anthropic_provider.AnthropicProvider = object
+    stubs = {
+        "reporting.generator": generator,
+        "providers": types.ModuleType("providers"),
+        "providers.openai_provider": openai_provider,
+        "providers.anthropic_provider": anthropic_provider,
+    }
+    with mock.patch.dict(sys.modules, stubs):
+        sys.modules.pop("anomaly_scanner.cross_probe", None)
+        return importlib.import_module("anomaly_scanner.cross_probe")
+
+
+cp = _load_cross_probe()
+
+A = [
+    "AnomalyScope detects drift in AI systems.",
+    "AnomalyScope  detects drift in AI systems.",
+    "It finds anomalies.",
+]
+B = [
+    "AnomalyScope is a tool for anomaly detection.",
+    "A tool to detect drift.",
+    "anomalyscope is a tool for anomaly detection.",
+]
+
+
+def test_fused_blocks_match_separate_scoring():
+    na = len(A)
+    matrix = cp.similarity_matrix(A + B)
+    for name, responses, block in (("a", A, matrix[:na, :na]), ("b", B, matrix[na:, na:])):
+        fused = cp.ProviderRun.from_matrix(name, responses, block)
+        separate = cp.ProviderRun.from_responses(name, responses)
+        assert fused.mean_similarity == pytest.approx(separate.mean_similarity)
+        assert fused.min_similarity == pytest.approx(separate.min_similarity)
+    fused_cross = cp.best_match_similarity(matrix[:na, na:])
+    assert fused_cross == pytest.approx(cp.cross_similarity(A, B))
+
+
+def test_unique_inverse_maps_back_to_input():
+    values = ["x", "y", "x", "z", "y"]
+    uniq, inverse = cp._unique(values)
+    assert uniq == ["x", "y", "z"]
+    assert [uniq[k] for k in inverse] == values
+    uniq, inverse = cp._unique([])
+    assert uniq == [] and inverse.shape == (0,)
+
+
+def test_similarity_matrix_gathers_duplicates():
+    responses = ["abc", "ABC ", "abd", "xyz", "abc"]
+    matrix = cp.similarity_matrix(responses)
+    assert matrix.shape == (5, 5)
+    canon = [cp.canonicalize(r) for r in responses]
+    for i in range(5):
+        for j in range(5):
+            assert matrix[i, j] == pytest.approx(Indel.normalized_similarity(canon[i], canon[j]))
+    assert cp.similarity_matrix(["a"], []).shape == (1, 0)
+    assert cp.ProviderRun.seq_sim("ABC ", "abd") == pytest.approx(matrix[1, 2])
+
+
+@pytest.mark.parametrize("n", [0, 1, 2, 3, 4])
+def test_from_matrix_keeps_upper_triangle(n):
+    responses = ["a" * k + "b" for k in range(n)]
+    matrix = cp.similarity_matrix(responses)
+    run = cp.ProviderRun.from_matrix("x", responses, matrix)
+    expected = matrix[np.triu_indices(n, 1)]
+    assert run.scores.dtype == np.float32
+    assert np.allclose(run.scores, expected)
+    assert run.sample_responses == responses[: cp.SAMPLE_SIZE]
+    if n < 2:
+        assert run.mean_similarity == run.min_similarity == 1.0
+    else:
+        # Published stats are not float32-quantized
+        assert run.mean_similarity == pytest.approx(expected.mean(), abs=1e-15)
+        assert run.min_similarity == expected.min()
+
+
+def test_classify_with_min_within():
+    runs = {
+        "x": cp.ProviderRun("x", [], np.array([], dtype=np.float32), 0.9, 0.9),
+        "y": cp.ProviderRun("y", [], np.array([], dtype=np.float32), 0.8, 0.8),
+    }
+    assert cp.min_within_similarity(runs) == 0.8
+    assert cp.min_within_similarity({}) == 1.0
+    assert cp.classify(0.5, runs, 0.85) == "high"
+    assert cp.classify(0.7, runs, 0.85) == "medium"
+    assert cp.classify(0.9, runs, 0.85) == "low"
+    assert cp.classify(0.9, runs, 0.75) == "none"
+    # A precomputed min_within is used as-is
+    assert cp.classify(0.9, runs, 0.85, min_within=0.95) == "none"
+
+
+def test_scorer_differs_from_difflib_ratio():
+    # Indel scores the LCS; difflib's Ratcliff-Obershelp only the greedy longest blocks.
+    # Cards scored by the two are not comparable, hence meta["scorer"].
+    a, b = "abcde", "acedb"
+    indel = cp.similarity_matrix([a], [b])[0, 0]
+    ratio = difflib.SequenceMatcher(a=a, b=b, autojunk=False).ratio()
+    assert indel == pytest.approx(0.6)
+    assert ratio == pytest.approx(0.4)
+    assert cp.SCORER == "rapidfuzz-indel"
+
+
+def test_card_key_ignores_timestamp():
+    card = StubCard(id="X", description="d", severity="low", timestamp="t1", meta={"k": 1})
+    same = StubCard(id="X", description="d", severity="low", timestamp="t2", meta={"k": 1})
+    other = StubCard(id="X", description="d", severity="low", timestamp="t1", meta={"k": 2})
+    assert cp._card_key(card) == cp._card_key(same)
+    assert cp._card_key(card) != cp._card_key(other)
+
+
+@pytest.mark.parametrize("updated", [True, False])
+def test_publish_records_key_only_on_success(tmp_path, monkeypatch, updated):
+    monkeypatch.setattr(cp, "_update_index_page", lambda: updated)
+    card = StubCard(id="X", description="d", severity="low", timestamp="t")
+    cp._publish(card, tmp_path / "LATEST_ANOMALY.md")
+    key_file = tmp_path / ".last_card_key"
+    assert key_file.exists() == updated
+    if updated:
+        assert key_file.read_text() == cp._card_key(card)
+
+
+
+def test_publish_skips_unchanged_card(tmp_path, monkeypatch):
+    calls = []
+    monkeypatch.setattr(cp, "_update_index_page", lambda: calls.append(1) or True)
+    latest = tmp_path / "LATEST_ANOMALY.md"
+    cp._publish(StubCard(id="X", description="d", severity="low", timestamp="t1"), latest)
+    cp._publish(StubCard(id="X", description="d", severity="low", timestamp="t2"), latest)
+    assert len(calls) == 1
+    cp._publish(StubCard(id="X", description="e", severity="low", timestamp="t3"), latest)
+    assert len(calls) == 2
+
+@pytest.mark.parametrize(
+    "body, rc, message",
+    [
+        ("pass", 0, ""),
+        ("raise SystemExit(None)", 0, ""),
+        ("raise SystemExit(3)", 3, ""),
+        ('raise SystemExit("x")', 1, "[pages] update_index.py: x"),
+    ],
+)
+def test_run_index_script_exit_codes(tmp_path, capsys, body, rc, message):
+    script = tmp_path / "update_index.py"
+    script.write_text(f"import sys\nseen = (list(sys.argv), sys.path[0])\nprint(seen)\n{body}\n")
+    argv, path = list(sys.argv), list(sys.path)
+    assert cp._run_index_script(script) == rc
+    out, err = capsys.readouterr()
+    # The script sees the argv and sys.path[0] that `python script` would give it
+    assert out.strip() == repr(([str(script)], str(tmp_path)))
+    assert err.strip() == message
+    assert sys.argv == argv and sys.path == path